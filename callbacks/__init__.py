@@ -12,6 +12,9 @@ from nio import (
     Response,
 )
 
+from functools import lru_cache
+from typing import Callable, Tuple
+
 from .test import test_callback
 from .sync import sync_callback
 from .invite import room_invite_callback
@@ -32,4 +35,36 @@ EVENT_CALLBACKS = {
     RoomMessageText: message_callback,
     MegolmEvent: message_callback,
     RoomMemberEvent: roommember_callback,
-}
\ No newline at end of file
+}
+
+
+@lru_cache(maxsize=None)
+def get_event_callbacks(event_type: type) -> Tuple[Callable, ...]:
+    """Get the callbacks to run for an event type, in registration order.
+
+    The result is cached per type, so dispatching an event is a single lookup.
+
+    Args:
+        event_type (type): The class of the event.
+
+    Returns:
+        Tuple[Callable, ...]: The matching callbacks.
+    """
+
+    return tuple(callback for eventtype, callback in EVENT_CALLBACKS.items() if issubclass(event_type, eventtype))
+
+
+@lru_cache(maxsize=None)
+def get_response_callbacks(response_type: type) -> Tuple[Callable, ...]:
+    """Get the callbacks to run for a response type, in registration order.
+
+    The result is cached per type, so dispatching a response is a single lookup.
+
+    Args:
+        response_type (type): The class of the response.
+
+    Returns:
+        Tuple[Callable, ...]: The matching callbacks.
+    """
+
+    return tuple(callback for responsetype, callback in RESPONSE_CALLBACKS.items() if issubclass(response_type, responsetype))
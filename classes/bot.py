@@ -23,6 +23,7 @@ from nio import (
     RoomSendResponse,
     SyncResponse,
     RoomMessageNotice,
+    RedactedEvent,
     JoinError,
     RoomLeaveError,
     RoomSendError,
@@ -37,24 +38,85 @@ from configparser import ConfigParser
 from datetime import datetime
 from io import BytesIO
 from pathlib import Path
+from collections import deque
 
 import uuid
 import traceback
 import json
+import re
+import functools
+import contextlib
+import threading
 
 from .logging import Logger
 from migrations import migrate
-from callbacks import RESPONSE_CALLBACKS, EVENT_CALLBACKS
+from callbacks import get_event_callbacks, get_response_callbacks
 from commands import COMMANDS
 from .store import DuckDBStore
 from .openai import OpenAI
 from .wolframalpha import WolframAlpha
 from .trackingmore import TrackingMore
 
+SQL_INSERT_TOKEN_USAGE = "INSERT INTO token_usage (message_id, room_id, tokens, api, timestamp) VALUES (?, ?, ?, ?, ?)"
+SQL_SELECT_ROOM_SETTING = "SELECT value FROM room_settings WHERE room_id = ? AND setting = ?"
+
+# Messages containing none of these are sent without an HTML body
+MARKDOWN_CHARACTERS = frozenset("`*_#[]<>~|\\")
+# Line-based markdown: bullet and numbered lists, setext headings
+MARKDOWN_LINE_PATTERN = re.compile(
+    r"^\s*(?:[-+*]\s|\d+[.)]\s|(?:-{3,}|={3,})\s*$)", re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=4)
+def _get_encoding(model: str) -> tiktoken.Encoding:
+    """Get the tiktoken encoding for a model.
+
+    Loading the BPE vocabulary is expensive, so the result is cached per model.
+
+    Args:
+        model (str): The model to get the encoding for.
+
+    Returns:
+        tiktoken.Encoding: The encoding for the model.
+    """
+
+    return tiktoken.encoding_for_model(model)
+
+
+@functools.lru_cache(maxsize=4096)
+def _count_tokens(model: str, text: str) -> int:
+    """Count the tokens a message takes up in the prompt.
+
+    Chat history is re-sent with every query, so counts are cached by content
+    and only new messages have to be encoded.
+
+    Args:
+        model (str): The model to count tokens for.
+        text (str): The message content.
+
+    Returns:
+        int: The number of tokens, including one token of message overhead.
+    """
+
+    if not text:
+        return 1
+
+    return len(_get_encoding(model).encode(text)) + 1
+
 
 class GPTBot:
     # Default values
     database: Optional[duckdb.DuckDBPyConnection] = None
+    # Long-lived cursor for queries that run on every message
+    database_cursor: Optional[duckdb.DuckDBPyConnection] = None
+    # Separate cursor for token usage writes, which run in a worker thread
+    usage_cursor: Optional[duckdb.DuckDBPyConnection] = None
+    usage_lock: Optional[threading.Lock] = None
+    # Token usage rows are buffered and written in batches
+    usage_buffer: List[Tuple[str, str, int, str, datetime]]
+    usage_flush_interval: int = 5  # Seconds between writes of buffered rows
+    usage_flush_size: int = 50  # Number of buffered rows that triggers a write
+    usage_flush_task: Optional[asyncio.Task] = None
     # Default name of rooms created by the bot
     display_name = default_room_name = "GPTBot"
     default_system_message: str = "You are a helpful assistant."
@@ -75,6 +137,9 @@ class GPTBot:
     logo: Optional[Image.Image] = None
     logo_uri: Optional[str] = None
     allowed_users: List[str] = []
+    system_message_cache: Dict[str, str]  # Room ID -> complete system message
+    ignore_older_cache: Dict[str, str]  # Room ID -> latest ignoreolder event ID
+    markdowner: Optional[markdown2.Markdown] = None
 
     @classmethod
     def from_config(cls, config: ConfigParser):
@@ -89,6 +154,10 @@ class GPTBot:
 
         # Create a new GPTBot instance
         bot = cls()
+        bot.system_message_cache = {}
+        bot.ignore_older_cache = {}
+        bot.usage_buffer = []
+        bot.markdowner = markdown2.Markdown(extras=["fenced-code-blocks"])
 
         # Set the database connection
         bot.database = duckdb.connect(
@@ -174,37 +243,71 @@ class GPTBot:
 
     async def _last_n_messages(self, room: str | MatrixRoom, n: Optional[int]):
         messages = []
-        n = n or bot.max_messages
+        n = n or self.max_messages
         room_id = room.room_id if isinstance(room, MatrixRoom) else room
+        start = self.sync_token
+        ignore_older_id = self.ignore_older_cache.get(room_id)
+        # Never look at more events than a single request for 2*n used to return
+        max_events = 2 * n
+        scanned = 0
 
         self.logger.log(
-            f"Fetching last {2*n} messages from room {room_id} (starting at {self.sync_token})...")
+            f"Fetching last {n} messages from room {room_id} (starting at {start})...")
+
+        # Page backwards through the room until we have enough messages, the
+        # history runs out, we hit an ignoreolder command or we have scanned
+        # max_events events
+        while len(messages) < n and scanned < max_events:
+            response = await self.matrix_client.room_messages(
+                room_id=room_id,
+                start=start,
+                limit=min(n, max_events - scanned),
+            )
 
-        response = await self.matrix_client.room_messages(
-            room_id=room_id,
-            start=self.sync_token,
-            limit=2*n,
-        )
+            if isinstance(response, RoomMessagesError):
+                raise Exception(
+                    f"Error fetching messages: {response.message} (status code {response.status_code})", "error")
 
-        if isinstance(response, RoomMessagesError):
-            raise Exception(
-                f"Error fetching messages: {response.message} (status code {response.status_code})", "error")
+            ignore_older = False
+            scanned += len(response.chunk)
 
-        for event in response.chunk:
-            if len(messages) >= n:
-                break
-            if isinstance(event, MegolmEvent):
-                try:
-                    event = await self.matrix_client.decrypt_event(event)
-                except (GroupEncryptionError, EncryptionError):
-                    self.logger.log(
-                        f"Could not decrypt message {event.event_id} in room {room_id}", "error")
-                    continue
-            if isinstance(event, (RoomMessageText, RoomMessageNotice)):
-                if event.body.startswith("!gptbot ignoreolder"):
+            for event in response.chunk:
+                if len(messages) >= n:
                     break
-                if (not event.body.startswith("!")) or (event.body.startswith("!gptbot")):
-                    messages.append(event)
+                # Stop at a known ignoreolder command without decrypting it
+                # again, unless it has been deleted since
+                if event.event_id == ignore_older_id:
+                    if isinstance(event, RedactedEvent) or "redacted_because" in event.source.get("unsigned", {}):
+                        self.ignore_older_cache.pop(room_id, None)
+                        ignore_older_id = None
+                    else:
+                        ignore_older = True
+                        break
+                if isinstance(event, MegolmEvent):
+                    # Relations stay unencrypted, so reactions can be skipped
+                    # without decrypting - they never contain a text message
+                    relates_to = event.source.get(
+                        "content", {}).get("m.relates_to", {})
+                    if relates_to.get("rel_type") == "m.annotation":
+                        continue
+                    try:
+                        event = await self.matrix_client.decrypt_event(event)
+                    except (GroupEncryptionError, EncryptionError):
+                        self.logger.log(
+                            f"Could not decrypt message {event.event_id} in room {room_id}", "error")
+                        continue
+                if isinstance(event, (RoomMessageText, RoomMessageNotice)):
+                    if event.body.startswith("!gptbot ignoreolder"):
+                        self.ignore_older_cache[room_id] = event.event_id
+                        ignore_older = True
+                        break
+                    if (not event.body.startswith("!")) or (event.body.startswith("!gptbot")):
+                        messages.append(event)
+
+            if ignore_older or not response.chunk or not response.end or response.end == start:
+                break
+
+            start = response.end
 
         self.logger.log(f"Found {len(messages)} messages (limit: {n})")
 
@@ -217,11 +320,10 @@ class GPTBot:
         model = model or self.chat_api.chat_model
         system_message = self.default_system_message if system_message is None else system_message
 
-        encoding = tiktoken.encoding_for_model(model)
         total_tokens = 0
 
-        system_message_tokens = 0 if not system_message else (
-            len(encoding.encode(system_message)) + 1)
+        system_message_tokens = 0 if not system_message else _count_tokens(
+            model, system_message)
 
         if system_message_tokens > max_tokens:
             self.logger.log(
@@ -230,18 +332,37 @@ class GPTBot:
 
         total_tokens += system_message_tokens
 
-        total_tokens = len(system_message) + 1
-        truncated_messages = []
+        if not messages:
+            return []
 
-        for message in [messages[0]] + list(reversed(messages[1:])):
-            content = message["content"]
-            tokens = len(encoding.encode(content)) + 1
+        # The first message is always kept, the rest are added newest first
+        # until the token limit is reached. If the first message is the system
+        # message, it has already been counted above.
+        first_message = messages[0]
+        if not (first_message.get("role") == "system" and first_message["content"] == system_message):
+            tokens = _count_tokens(model, first_message["content"])
+            if total_tokens + tokens > max_tokens:
+                return []
+            total_tokens += tokens
+
+        truncated_messages = deque()
+
+        # Bind lookups to locals for the loop
+        count_tokens = _count_tokens
+        prepend = truncated_messages.appendleft
+
+        for i in range(len(messages) - 1, 0, -1):
+            message = messages[i]
+            tokens = count_tokens(model, message["content"])
             if total_tokens + tokens > max_tokens:
                 break
             total_tokens += tokens
-            truncated_messages.append(message)
+            prepend(message)
+
+        if self.debug:
+            assert total_tokens <= max_tokens, "Truncated messages exceed token limit"
 
-        return [truncated_messages[0]] + list(reversed(truncated_messages[1:]))
+        return [first_message, *truncated_messages]
 
     async def _get_device_id(self) -> str:
         """Guess the device ID of the bot.
@@ -291,19 +412,17 @@ class GPTBot:
         """
         room_id = room.room_id if isinstance(room, MatrixRoom) else room
 
-        with self.database.cursor() as cursor:
-            cursor.execute(
-                "SELECT value FROM room_settings WHERE room_id = ? AND setting = ?", (room_id, "use_classification"))
-            result = cursor.fetchone()
+        self.database_cursor.execute(
+            SQL_SELECT_ROOM_SETTING, (room_id, "use_classification"))
+        result = self.database_cursor.fetchone()
 
         return False if not result else bool(int(result[0]))
 
     async def _event_callback(self, room: MatrixRoom, event: Event):
         self.logger.log("Received event: " + str(event.event_id), "debug")
         try:
-            for eventtype, callback in EVENT_CALLBACKS.items():
-                if isinstance(event, eventtype):
-                    await callback(room, event, self)
+            for callback in get_event_callbacks(type(event)):
+                await callback(room, event, self)
         except Exception as e:
             self.logger.log(
                 f"Error in event callback for {event.__class__}: {e}", "error")
@@ -363,17 +482,15 @@ class GPTBot:
         """
         room_id = room.room_id
 
-        with self.database.cursor() as cursor:
-            cursor.execute(
-                "SELECT value FROM room_settings WHERE room_id = ? AND setting = ?", (room_id, "use_timing"))
-            result = cursor.fetchone()
+        self.database_cursor.execute(
+            SQL_SELECT_ROOM_SETTING, (room_id, "use_timing"))
+        result = self.database_cursor.fetchone()
 
         return False if not result else bool(int(result[0]))
 
     async def _response_callback(self, response: Response):
-        for response_type, callback in RESPONSE_CALLBACKS.items():
-            if isinstance(response, response_type):
-                await callback(response, self)
+        for callback in get_response_callbacks(type(response)):
+            await callback(response, self)
 
     async def response_callback(self, response: Response):
         task = asyncio.create_task(self._response_callback(response))
@@ -489,21 +606,21 @@ class GPTBot:
         if isinstance(room, str):
             room = self.matrix_client.rooms[room]
 
-        markdowner = markdown2.Markdown(extras=["fenced-code-blocks"])
-        formatted_body = markdowner.convert(message)
-
         msgtype = "m.notice" if notice else "m.text"
 
-        msgcontent = {"msgtype": msgtype, "body": message,
-                      "format": "org.matrix.custom.html", "formatted_body": formatted_body}
+        msgcontent = {"msgtype": msgtype, "body": message}
+
+        # Plain text messages don't need an HTML version
+        if not MARKDOWN_CHARACTERS.isdisjoint(message) or MARKDOWN_LINE_PATTERN.search(message):
+            msgcontent["format"] = "org.matrix.custom.html"
+            msgcontent["formatted_body"] = self.markdowner.convert(message)
 
         content = None
 
         if self.matrix_client.olm and room.encrypted:
             try:
                 if not room.members_synced:
-                    responses = []
-                    responses.append(await self.matrix_client.joined_members(room.room_id))
+                    await self.matrix_client.joined_members(room.room_id)
 
                 if self.matrix_client.olm.should_share_group_session(room.room_id):
                     try:
@@ -530,7 +647,7 @@ class GPTBot:
             content = msgcontent
 
         method, path, data = Api.room_send(
-            self.matrix_client.access_token, room.room_id, msgtype, content, uuid.uuid4()
+            self.matrix_client.access_token, room.room_id, msgtype, content, uuid.uuid4().hex
         )
 
         response = await self.matrix_client._send(RoomSendResponse, method, path, data, (room.room_id,))
@@ -540,9 +657,11 @@ class GPTBot:
                 f"Error sending message: {response.message}", "error")
             return
 
-    def log_api_usage(self, message: Event | str, room: MatrixRoom | str, api: str, tokens: int):
+    async def log_api_usage(self, message: Event | str, room: MatrixRoom | str, api: str, tokens: int):
         """Log API usage to the database.
 
+        Rows are buffered and written in batches by flush_api_usage().
+
         Args:
             message (Event): The event that triggered the API usage.
             room (MatrixRoom | str): The room the event was sent in.
@@ -559,10 +678,56 @@ class GPTBot:
         if isinstance(room, MatrixRoom):
             room = room.room_id
 
-        self.database.execute(
-            "INSERT INTO token_usage (message_id, room_id, tokens, api, timestamp) VALUES (?, ?, ?, ?, ?)",
-            (message, room, tokens, api, datetime.now())
-        )
+        self.usage_buffer.append((message, room, tokens, api, datetime.now()))
+
+        if len(self.usage_buffer) >= self.usage_flush_size:
+            await self.flush_api_usage()
+
+    async def flush_api_usage(self):
+        """Write all buffered token usage rows to the database.
+
+        The insert is run in a worker thread so it doesn't block the event loop.
+        """
+
+        if not self.usage_buffer:
+            return
+
+        rows, self.usage_buffer = self.usage_buffer, []
+
+        try:
+            # If this is cancelled, the worker thread still writes the rows
+            await asyncio.to_thread(self._record_api_usage, rows)
+        except Exception:
+            # Keep the rows so they are written with the next batch
+            self.usage_buffer[:0] = rows
+            raise
+
+    def _record_api_usage(self, rows: List[Tuple[str, str, int, str, datetime]]):
+        """Write token usage rows to the database in a single transaction. Blocking.
+
+        Args:
+            rows (List[Tuple[str, str, int, str, datetime]]): The values to insert.
+        """
+
+        with self.usage_lock:
+            self.usage_cursor.begin()
+            try:
+                self.usage_cursor.executemany(SQL_INSERT_TOKEN_USAGE, rows)
+            except Exception:
+                self.usage_cursor.rollback()
+                raise
+            self.usage_cursor.commit()
+
+    async def _flush_api_usage_loop(self):
+        """Periodically write buffered token usage rows to the database."""
+
+        while True:
+            await asyncio.sleep(self.usage_flush_interval)
+
+            try:
+                await self.flush_api_usage()
+            except Exception as e:
+                self.logger.log(f"Error writing token usage: {e}", "error")
 
     async def run(self):
         """Start the bot."""
@@ -594,69 +759,82 @@ class GPTBot:
         else:
             self.logger.log(f"Already at latest version {after}.")
 
-        if IN_MEMORY:
-            client_config = AsyncClientConfig(
-                store_sync_tokens=True, encryption_enabled=False)
-        else:
-            matrix_store = DuckDBStore
-            client_config = AsyncClientConfig(
-                store_sync_tokens=True, encryption_enabled=True, store=matrix_store)
-            self.matrix_client.config = client_config
-            self.matrix_client.store = matrix_store(
-                self.matrix_client.user_id,
-                self.matrix_client.device_id,
-                self.database
-            )
+        # Everything from here on is cleaned up by aclose(), however run() exits
+        try:
+            self.database_cursor = self.database.cursor()
+            self.usage_cursor = self.database.cursor()
+            self.usage_lock = threading.Lock()
+            self.usage_flush_task = asyncio.create_task(
+                self._flush_api_usage_loop())
+
+            if IN_MEMORY:
+                client_config = AsyncClientConfig(
+                    store_sync_tokens=True, encryption_enabled=False)
+            else:
+                matrix_store = DuckDBStore
+                client_config = AsyncClientConfig(
+                    store_sync_tokens=True, encryption_enabled=True, store=matrix_store)
+                self.matrix_client.config = client_config
+                self.matrix_client.store = matrix_store(
+                    self.matrix_client.user_id,
+                    self.matrix_client.device_id,
+                    self.database
+                )
 
-            self.matrix_client.olm = Olm(
-                self.matrix_client.user_id,
-                self.matrix_client.device_id,
-                self.matrix_client.store
-            )
+                self.matrix_client.olm = Olm(
+                    self.matrix_client.user_id,
+                    self.matrix_client.device_id,
+                    self.matrix_client.store
+                )
 
-            self.matrix_client.encrypted_rooms = self.matrix_client.store.load_encrypted_rooms()
+                self.matrix_client.encrypted_rooms = self.matrix_client.store.load_encrypted_rooms()
 
-        # Run initial sync (now includes joining rooms)
-        sync = await self.matrix_client.sync(timeout=30000)
-        if isinstance(sync, SyncResponse):
-            await self.response_callback(sync)
-        else:
-            self.logger.log(f"Initial sync failed, aborting: {sync}", "error")
-            return
+            # Keep connections to the OpenAI API open between requests
+            await self.chat_api.open_session()
 
-        # Set up callbacks
+            # Run initial sync (now includes joining rooms)
+            sync = await self.matrix_client.sync(timeout=30000)
+            if isinstance(sync, SyncResponse):
+                await self.response_callback(sync)
+            else:
+                self.logger.log(f"Initial sync failed, aborting: {sync}", "error")
+                return
 
-        self.matrix_client.add_event_callback(self.event_callback, Event)
-        self.matrix_client.add_response_callback(
-            self.response_callback, Response)
+            # Set up callbacks
 
-        # Set custom name / logo
+            self.matrix_client.add_event_callback(self.event_callback, Event)
+            self.matrix_client.add_response_callback(
+                self.response_callback, Response)
 
-        if self.display_name:
-            self.logger.log(f"Setting display name to {self.display_name}")
-            await self.matrix_client.set_displayname(self.display_name)
-        if self.logo:
-            self.logger.log("Setting avatar...")
-            logo_bio = BytesIO()
-            self.logo.save(logo_bio, format=self.logo.format)
-            uri = await self.upload_file(logo_bio.getvalue(), "logo", Image.MIME[self.logo.format])
-            self.logo_uri = uri
+            # Set custom name / logo
 
-            asyncio.create_task(self.matrix_client.set_avatar(uri))
+            if self.display_name:
+                self.logger.log(f"Setting display name to {self.display_name}")
+                await self.matrix_client.set_displayname(self.display_name)
+            if self.logo:
+                self.logger.log("Setting avatar...")
+                logo_bio = BytesIO()
+                self.logo.save(logo_bio, format=self.logo.format)
+                uri = await self.upload_file(logo_bio.getvalue(), "logo", Image.MIME[self.logo.format])
+                self.logo_uri = uri
 
-            for room in self.matrix_client.rooms.keys():
-                self.logger.log(f"Setting avatar for {room}...", "debug")
-                asyncio.create_task(self.matrix_client.room_put_state(room, "m.room.avatar", {
-                    "url": uri
-                }, ""))
+                asyncio.create_task(self.matrix_client.set_avatar(uri))
 
-        # Start syncing events
-        self.logger.log("Starting sync loop...")
-        try:
-            await self.matrix_client.sync_forever(timeout=30000)
+                for room in self.matrix_client.rooms.keys():
+                    self.logger.log(f"Setting avatar for {room}...", "debug")
+                    asyncio.create_task(self.matrix_client.room_put_state(room, "m.room.avatar", {
+                        "url": uri
+                    }, ""))
+
+            # Start syncing events
+            self.logger.log("Starting sync loop...")
+            try:
+                await self.matrix_client.sync_forever(timeout=30000)
+            finally:
+                self.logger.log("Syncing one last time...")
+                await self.matrix_client.sync(timeout=30000)
         finally:
-            self.logger.log("Syncing one last time...")
-            await self.matrix_client.sync(timeout=30000)
+            await self.aclose()
 
     async def create_space(self, name, visibility=RoomVisibility.private) -> str:
         """Create a space.
@@ -723,10 +901,9 @@ class GPTBot:
         if isinstance(room, MatrixRoom):
             room = room.room_id
 
-        with self.database.cursor() as cursor:
-            cursor.execute(
-                "SELECT value FROM room_settings WHERE room_id = ? AND setting = ?", (room, "always_reply"))
-            result = cursor.fetchone()
+        self.database_cursor.execute(
+            SQL_SELECT_ROOM_SETTING, (room, "always_reply"))
+        result = self.database_cursor.fetchone()
 
         return True if not result else bool(int(result[0]))
 
@@ -742,15 +919,25 @@ class GPTBot:
         if not (from_chat_command or self.respond_to_room_messages(room) or self.matrix_client.user_id in event.body):
             return
 
-        await self.matrix_client.room_typing(room.room_id, True)
+        # These calls don't depend on each other, so run them concurrently
+        typing, read_markers, last_messages = await asyncio.gather(
+            self.matrix_client.room_typing(room.room_id, True),
+            self.matrix_client.room_read_markers(room.room_id, event.event_id),
+            self._last_n_messages(room.room_id, 20),
+            return_exceptions=True
+        )
 
-        await self.matrix_client.room_read_markers(room.room_id, event.event_id)
+        if isinstance(typing, BaseException):
+            self.logger.log(f"Error sending typing notification: {typing}", "error")
+
+        if isinstance(read_markers, BaseException):
+            self.logger.log(f"Error setting read markers: {read_markers}", "error")
 
         if (not from_chat_command) and self.room_uses_classification(room):
-            classification, tokens = self.classification_api.classify_message(
+            classification, tokens = await self.classification_api.classify_message(
                 event.body, room.room_id)
 
-            self.log_api_usage(
+            await self.log_api_usage(
                 event, room, f"{self.classification_api.api_code}-{self.classification_api.classification_api}", tokens)
 
             if not classification["type"] == "chat":
@@ -758,32 +945,31 @@ class GPTBot:
                 await self.process_command(room, event)
                 return
 
-        try:
-            last_messages = await self._last_n_messages(room.room_id, 20)
-        except Exception as e:
-            self.logger.log(f"Error getting last messages: {e}", "error")
+        if isinstance(last_messages, BaseException):
+            self.logger.log(
+                f"Error getting last messages: {last_messages}", "error")
             await self.send_message(
                 room, "Something went wrong. Please try again.", True)
             return
 
         system_message = self.get_system_message(room)
 
-        chat_messages = [{"role": "system", "content": system_message}]
-
-        for message in last_messages:
-            role = "assistant" if message.sender == self.matrix_client.user_id else "user"
-            if not message.event_id == event.event_id:
-                chat_messages.append({"role": role, "content": message.body})
+        bot_user_id = self.matrix_client.user_id
+        event_id = event.event_id
 
-        chat_messages.append({"role": "user", "content": event.body})
+        chat_messages = [{"role": "system", "content": system_message}] + [
+            {"role": "assistant" if message.sender == bot_user_id else "user",
+             "content": message.body}
+            for message in last_messages if message.event_id != event_id
+        ] + [{"role": "user", "content": event.body}]
 
         # Truncate messages to fit within the token limit
         truncated_messages = self._truncate(
             chat_messages, self.max_tokens - 1, system_message=system_message)
 
         try:
-            response, tokens_used = self.chat_api.generate_chat_response(
-                chat_messages, user=room.room_id)
+            response, tokens_used = await self.chat_api.generate_chat_response(
+                truncated_messages, user=room.room_id)
         except Exception as e:
             self.logger.log(f"Error generating response: {e}", "error")
             await self.send_message(
@@ -791,7 +977,7 @@ class GPTBot:
             return
 
         if response:
-            self.log_api_usage(
+            await self.log_api_usage(
                 event, room, f"{self.chat_api.api_code}-{self.chat_api.chat_api}", tokens_used)
 
             self.logger.log(f"Sending response to room {room.room_id}...")
@@ -825,23 +1011,47 @@ class GPTBot:
         else:
             room_id = room.room_id
 
-        with self.database.cursor() as cur:
-            cur.execute(
-                "SELECT value FROM room_settings WHERE room_id = ? AND setting = ?",
-                (room_id, "system_message")
-            )
-            system_message = cur.fetchone()
+        if room_id in self.system_message_cache:
+            return self.system_message_cache[room_id]
+
+        self.database_cursor.execute(
+            SQL_SELECT_ROOM_SETTING, (room_id, "system_message"))
+        system_message = self.database_cursor.fetchone()
 
         complete = ((default if ((not system_message) or self.force_system_message) else "") + (
             "\n\n" + system_message[0] if system_message else "")).strip()
 
+        self.system_message_cache[room_id] = complete
+
         return complete
 
-    def __del__(self):
-        """Close the bot."""
+    async def aclose(self):
+        """Close the bot's Matrix client and database connection."""
 
         if self.matrix_client:
-            asyncio.run(self.matrix_client.close())
+            await self.matrix_client.close()
+
+        if self.chat_api:
+            await self.chat_api.close()
+
+        if self.usage_flush_task:
+            self.usage_flush_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.usage_flush_task
+            self.usage_flush_task = None
 
         if self.database:
-            self.database.close()
+            try:
+                await self.flush_api_usage()
+            except Exception as e:
+                self.logger.log(f"Error writing token usage: {e}", "error")
+
+            if self.usage_lock:
+                # A write from a cancelled flush may still be running in its
+                # worker thread - wait for it before closing the connection
+                with self.usage_lock:
+                    self.database.close()
+            else:
+                self.database.close()
+
+            self.database = None
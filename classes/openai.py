@@ -1,5 +1,6 @@
 import openai
 import requests
+import aiohttp
 
 import json
 
@@ -11,6 +12,7 @@ class OpenAI:
     api_key: str
     chat_model: str = "gpt-3.5-turbo"
     logger: Logger
+    session: Optional[aiohttp.ClientSession] = None
 
     api_code: str = "openai"
 
@@ -28,7 +30,25 @@ class OpenAI:
         self.chat_model = chat_model or self.chat_model
         self.logger = logger or Logger()
 
-    def generate_chat_response(self, messages: List[Dict[str, str]], user: Optional[str] = None) -> Tuple[str, int]:
+    async def open_session(self):
+        """Open an HTTP session that is reused for all async API requests.
+
+        Must be called from within the running event loop.
+        """
+
+        if not self.session:
+            self.session = aiohttp.ClientSession()
+
+        openai.aiosession.set(self.session)
+
+    async def close(self):
+        """Close the HTTP session, if one is open."""
+
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def generate_chat_response(self, messages: List[Dict[str, str]], user: Optional[str] = None) -> Tuple[str, int]:
         """Generate a response to a chat message.
 
         Args:
@@ -40,7 +60,7 @@ class OpenAI:
 
         self.logger.log(f"Generating response to {len(messages)} messages using {self.chat_model}...")
 
-        response = openai.ChatCompletion.create(
+        response = await openai.ChatCompletion.acreate(
             model=self.chat_model,
             messages=messages,
             api_key=self.api_key,
@@ -52,7 +72,7 @@ class OpenAI:
         self.logger.log(f"Generated response with {tokens_used} tokens.")
         return result_text, tokens_used
 
-    def classify_message(self, query: str, user: Optional[str] = None) -> Tuple[Dict[str, str], int]:
+    async def classify_message(self, query: str, user: Optional[str] = None) -> Tuple[Dict[str, str], int]:
         system_message = """You are a classifier for different types of messages. You decide whether an incoming message is meant to be a prompt for an AI chat model, or meant for a different API. You respond with a JSON object like this:
 
 { "type": event_type, "prompt": prompt }
@@ -80,7 +100,7 @@ Only the event_types mentioned above are allowed, you must not respond in any ot
 
         self.logger.log(f"Classifying message '{query}'...")
 
-        response = openai.ChatCompletion.create(
+        response = await openai.ChatCompletion.acreate(
             model=self.chat_model,
             messages=messages,
             api_key=self.api_key,
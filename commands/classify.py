@@ -8,7 +8,7 @@ async def command_classify(room: MatrixRoom, event: RoomMessageText, bot):
     if prompt:
         bot.logger.log("Classifying message...")
 
-        response, tokens_used = bot.classification_api.classify_message(prompt, user=room.room_id)
+        response, tokens_used = await bot.classification_api.classify_message(prompt, user=room.room_id)
 
         message = f"The message you provided seems to be of type: {response['type']}."
 
@@ -17,7 +17,7 @@ async def command_classify(room: MatrixRoom, event: RoomMessageText, bot):
 
         await bot.send_message(room, message, True)
 
-        bot.log_api_usage(event, room, f"{bot.classification_api.api_code}-{bot.classification_api.classification_api}", tokens_used)
+        await bot.log_api_usage(event, room, f"{bot.classification_api.api_code}-{bot.classification_api.classification_api}", tokens_used)
 
         return
 
@@ -13,7 +13,7 @@ async def command_parcel(room: MatrixRoom, event: RoomMessageText, bot):
 
             await bot.send_message(room, status, True)
 
-            bot.log_api_usage(event, room, f"{bot.parcel_api.api_code}-{bot.parcel_api.parcel_api}", tokens_used)
+            await bot.log_api_usage(event, room, f"{bot.parcel_api.api_code}-{bot.parcel_api.parcel_api}", tokens_used)
             return
 
     await bot.send_message(room, "You need to provide tracking numbers.", True)
\ No newline at end of file
@@ -23,6 +23,8 @@ async def command_roomsettings(room: MatrixRoom, event: RoomMessageText, bot):
                     (room.room_id, "system_message", value, value)
                 )
 
+            bot.system_message_cache.pop(room.room_id, None)
+
             await bot.send_message(room, f"Alright, I've stored the system message: '{value}'.", True)
             return
 
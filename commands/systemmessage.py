@@ -17,6 +17,8 @@ async def command_systemmessage(room: MatrixRoom, event: RoomMessageText, bot):
                 (room.room_id, "system_message", system_message, system_message)
             )
 
+        bot.system_message_cache.pop(room.room_id, None)
+
         await bot.send_message(room, f"Alright, I've stored the system message: '{system_message}'.", True)
         return
 